@@ -5,15 +5,137 @@ Uses SQLite for demo-friendly local storage
 import sqlite3
 import os
 import hashlib
-import pytz
-from datetime import datetime
-from typing import List, Dict, Any, Optional
+import hmac
+import threading
+import time
+from contextlib import closing, contextmanager
+from typing import Iterator, List, Dict, Any, Optional
 
 DATABASE_PATH = "fraud_detection.db"
 
+# Click and session timestamps are stored as integer Unix epoch seconds (UTC)
+# and only turned into IST (UTC+5:30) wall-clock strings when read for display
+IST_OFFSET_MINUTES = 330
+
+# Applied once when a connection is opened. WAL lets dashboard reads run while
+# a click is being written, and synchronous=NORMAL makes each commit a single
+# WAL fsync instead of several writes to the main database file.
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+)
+
+# sqlite3 keeps compiled statements in a per-connection LRU keyed by the SQL
+# text, so the queries below live in module-level constants and connections
+# are never closed: closing a connection throws its statement cache away.
+STATEMENT_CACHE_SIZE = 256
+
+# While one worker migrates a large legacy database, the others wait in
+# init_database() well past the normal busy timeout
+SCHEMA_BUSY_TIMEOUT_MS = 300000
+
+_local = threading.local()
+
+def _get_conn() -> sqlite3.Connection:
+    """Get the calling thread's persistent connection, opening it on first use"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        # Autocommit mode; multi-statement writes go through _transaction()
+        conn = sqlite3.connect(DATABASE_PATH, cached_statements=STATEMENT_CACHE_SIZE,
+                               isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        _local.conn = conn
+    return conn
+
+@contextmanager
+def _transaction(conn: sqlite3.Connection):
+    """Run the enclosed statements as one transaction, rolling back on error"""
+    # IMMEDIATE takes the write lock up front, so busy_timeout applies instead
+    # of failing when a deferred read transaction later tries to write
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+BACKFILL_ADVERTISER_ROLLUP_SQL = """
+    INSERT OR IGNORE INTO advertiser_rollup (advertiser_id, total_clicks, fraud_clicks, sum_prob)
+    SELECT advertiser_id, COUNT(*), SUM(is_fraud = 1), SUM(fraud_probability)
+    FROM click_logs
+    GROUP BY advertiser_id
+"""
+
+BACKFILL_AD_ROLLUP_SQL = """
+    INSERT OR IGNORE INTO ad_rollup (ad_id, total_clicks, fraud_clicks, sum_prob)
+    SELECT ad_id, COUNT(*), SUM(is_fraud = 1), SUM(fraud_probability)
+    FROM click_logs
+    GROUP BY ad_id
+"""
+
+BACKFILL_ADS_NAMES_SQL = """
+    UPDATE ads SET advertiser_name = (SELECT name FROM advertisers WHERE id = ads.advertiser_id)
+"""
+
+BACKFILL_CLICK_NAMES_SQL = """
+    UPDATE click_logs SET
+        ad_title = (SELECT title FROM ads WHERE id = click_logs.ad_id),
+        advertiser_name = (SELECT name FROM advertisers WHERE id = click_logs.advertiser_id)
+"""
+
+# Text sorts after every number in SQLite, so ">= ''" selects only legacy
+# string timestamps; for click_logs that is a range scan of idx_clicks_date
+CONVERT_LEGACY_CLICK_TIMES_SQL = f"""
+    UPDATE click_logs
+    SET clicked_at = CAST(strftime('%s', clicked_at, '-{IST_OFFSET_MINUTES} minutes') AS INTEGER)
+    WHERE clicked_at >= ''
+"""
+
+# Legacy last_updated strings are not uniformly IST: a session's first click
+# left the UTC CURRENT_TIMESTAMP default and only later clicks wrote IST. The
+# session's latest click (converted above) is the value log_click() now keeps,
+# so rebuild from that, falling back to reading the string as IST
+CONVERT_LEGACY_SESSION_TIMES_SQL = f"""
+    UPDATE session_summary
+    SET last_updated = COALESCE(
+        (SELECT MAX(clicked_at) FROM click_logs WHERE session_id = session_summary.session_id),
+        CAST(strftime('%s', last_updated, '-{IST_OFFSET_MINUTES} minutes') AS INTEGER)
+    )
+    WHERE last_updated >= ''
+"""
+
+def _add_column_if_missing(conn, table: str, column: str, declaration: str) -> bool:
+    """Add a column to an existing table; returns True if it was added"""
+    columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column in columns:
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+    return True
+
 def init_database():
     """Initialize the SQLite database with required tables"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = _get_conn()
+    # One IMMEDIATE transaction for the whole setup; SQLite DDL is
+    # transactional, so server workers starting together run the schema
+    # checks and migrations one at a time instead of racing on them
+    conn.execute(f"PRAGMA busy_timeout={SCHEMA_BUSY_TIMEOUT_MS}")
+    try:
+        with _transaction(conn):
+            _create_schema(conn)
+    finally:
+        conn.execute("PRAGMA busy_timeout=5000")
+    
+    print("Database initialized successfully")
+
+def _create_schema(conn: sqlite3.Connection):
+    """Create or migrate tables, triggers, indexes and views; run by init_database"""
     cursor = conn.cursor()
     
     # Advertisers table
@@ -38,6 +160,7 @@ def init_database():
             target_url TEXT,
             is_active BOOLEAN DEFAULT 1,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            advertiser_name TEXT,
             FOREIGN KEY (advertiser_id) REFERENCES advertisers (id)
         )
     """)
@@ -57,7 +180,9 @@ def init_database():
             fraud_probability REAL NOT NULL,
             risk_level TEXT NOT NULL,
             model_used TEXT NOT NULL,
-            clicked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            clicked_at INTEGER DEFAULT (strftime('%s', 'now')),
+            ad_title TEXT,
+            advertiser_name TEXT,
             FOREIGN KEY (ad_id) REFERENCES ads (id),
             FOREIGN KEY (advertiser_id) REFERENCES advertisers (id)
         )
@@ -79,42 +204,113 @@ def init_database():
             fraud_probability REAL NOT NULL,
             risk_level TEXT NOT NULL,
             model_used TEXT NOT NULL,
-            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_updated INTEGER DEFAULT (strftime('%s', 'now')),
             FOREIGN KEY (ad_id) REFERENCES ads (id),
             FOREIGN KEY (advertiser_id) REFERENCES advertisers (id)
         )
     """)
     
+    # Names copied onto ads and click_logs so reads skip the joins; databases
+    # created before these columns existed get them filled in once
+    if _add_column_if_missing(conn, "ads", "advertiser_name", "TEXT"):
+        conn.execute(BACKFILL_ADS_NAMES_SQL)
+    added_title = _add_column_if_missing(conn, "click_logs", "ad_title", "TEXT")
+    added_name = _add_column_if_missing(conn, "click_logs", "advertiser_name", "TEXT")
+    if added_title or added_name:
+        conn.execute(BACKFILL_CLICK_NAMES_SQL)
+    
+    # Keep the copies in step when an advertiser or ad is renamed
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_advertiser_name_update
+        AFTER UPDATE OF name ON advertisers
+        BEGIN
+            UPDATE ads SET advertiser_name = NEW.name WHERE advertiser_id = NEW.id;
+            UPDATE click_logs SET advertiser_name = NEW.name WHERE advertiser_id = NEW.id;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_ad_title_update
+        AFTER UPDATE OF title ON ads
+        BEGIN
+            UPDATE click_logs SET ad_title = NEW.title WHERE ad_id = NEW.id;
+        END
+    """)
+    
+    # Click counters maintained by log_click, so dashboards read a few rows
+    # instead of re-aggregating click_logs on every refresh
+    rollups_exist = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'advertiser_rollup'"
+    ).fetchone() is not None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS advertiser_rollup (
+            advertiser_id INTEGER PRIMARY KEY,
+            total_clicks INTEGER NOT NULL DEFAULT 0,
+            fraud_clicks INTEGER NOT NULL DEFAULT 0,
+            sum_prob REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY (advertiser_id) REFERENCES advertisers (id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ad_rollup (
+            ad_id INTEGER PRIMARY KEY,
+            total_clicks INTEGER NOT NULL DEFAULT 0,
+            fraud_clicks INTEGER NOT NULL DEFAULT 0,
+            sum_prob REAL NOT NULL DEFAULT 0,
+            FOREIGN KEY (ad_id) REFERENCES ads (id)
+        )
+    """)
+    
     # Create indexes for better performance
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_clicks_ad_id ON click_logs(ad_id)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_clicks_session ON click_logs(session_id)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_clicks_fraud ON click_logs(is_fraud)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_clicks_date ON click_logs(clicked_at)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_session_summary_advertiser ON session_summary(advertiser_id)")
+    # Serves get_recent_clicks in index order, so ORDER BY ... LIMIT needs no
+    # sort; it also covers plain advertiser_id lookups
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_session_summary_recent
+        ON session_summary(advertiser_id, last_updated DESC)
+    """)
+    cursor.execute("DROP INDEX IF EXISTS idx_session_summary_advertiser")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_session_summary_session ON session_summary(session_id)")
     
-    conn.commit()
-    conn.close()
-    print("Database initialized successfully")
+    # Per-advertiser aggregates are read from advertiser_rollup, so this
+    # covering index only added work to every click insert
+    cursor.execute("DROP INDEX IF EXISTS idx_clicks_advertiser_fraud")
+    
+    # Databases from before epoch timestamps hold IST strings; convert them
+    # in place (a no-op once converted)
+    conn.execute(CONVERT_LEGACY_CLICK_TIMES_SQL)
+    conn.execute(CONVERT_LEGACY_SESSION_TIMES_SQL)
+    
+    # IST-formatted views for ad-hoc queries and exports
+    cursor.execute(f"""
+        CREATE VIEW IF NOT EXISTS click_logs_ist AS
+        SELECT *, datetime(clicked_at, 'unixepoch', '+{IST_OFFSET_MINUTES} minutes') as clicked_at_ist
+        FROM click_logs
+    """)
+    cursor.execute(f"""
+        CREATE VIEW IF NOT EXISTS session_summary_ist AS
+        SELECT *, datetime(last_updated, 'unixepoch', '+{IST_OFFSET_MINUTES} minutes') as last_updated_ist
+        FROM session_summary
+    """)
+    
+    # Seed the counters from clicks logged before the rollup tables existed
+    if not rollups_exist:
+        conn.execute(BACKFILL_ADVERTISER_ROLLUP_SQL)
+        conn.execute(BACKFILL_AD_ROLLUP_SQL)
 
 def insert_sample_data():
     """Insert sample advertisers and ads for demo"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+    conn = _get_conn()
     
     # Sample advertisers with hashed passwords (password: "demo123")
-    password_hash = hashlib.sha256("demo123".encode()).hexdigest()
     advertisers = [
-        ("TechCorp", "ads@techcorp.com", password_hash),
-        ("FashionBrand", "marketing@fashionbrand.com", password_hash),
-        ("GameStudio", "promo@gamestudio.com", password_hash)
+        ("TechCorp", "ads@techcorp.com", DEMO_PASSWORD_HASH),
+        ("FashionBrand", "marketing@fashionbrand.com", DEMO_PASSWORD_HASH),
+        ("GameStudio", "promo@gamestudio.com", DEMO_PASSWORD_HASH)
     ]
     
-    cursor.executemany(
-        "INSERT OR IGNORE INTO advertisers (name, email, password_hash) VALUES (?, ?, ?)",
-        advertisers
-    )
-    
     # Sample ads
     ads = [
         (1, "Latest Smartphone", "Revolutionary new phone with AI features", 
@@ -131,326 +327,347 @@ def insert_sample_data():
          "/static/images/puzzle.jpg", "https://gamestudio.com/puzzle")
     ]
     
-    cursor.executemany(
-        "INSERT OR IGNORE INTO ads (advertiser_id, title, description, image_url, target_url) VALUES (?, ?, ?, ?, ?)",
-        ads
-    )
+    # One transaction for the whole seed instead of a commit per row
+    with _transaction(conn):
+        conn.executemany(
+            "INSERT OR IGNORE INTO advertisers (name, email, password_hash) VALUES (?, ?, ?)",
+            advertisers
+        )
+        # ads has no natural key for OR IGNORE to act on, so skip titles the
+        # advertiser already has; every server worker runs this seed
+        conn.executemany(
+            "INSERT INTO ads (advertiser_id, title, description, image_url, target_url, advertiser_name) "
+            "SELECT ?1, ?2, ?3, ?4, ?5, (SELECT name FROM advertisers WHERE id = ?1) "
+            "WHERE NOT EXISTS (SELECT 1 FROM ads WHERE advertiser_id = ?1 AND title = ?2)",
+            ads
+        )
     
-    conn.commit()
-    conn.close()
     print("Sample data inserted successfully")
 
-def get_ads() -> List[Dict[str, Any]]:
+GET_ADS_SQL = """
+    SELECT * FROM ads
+    WHERE is_active = 1
+    ORDER BY created_at DESC
+"""
+
+def get_ads() -> List[sqlite3.Row]:
     """Get all active ads"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT a.*, adv.name as advertiser_name 
-        FROM ads a 
-        JOIN advertisers adv ON a.advertiser_id = adv.id 
-        WHERE a.is_active = 1
-        ORDER BY a.created_at DESC
-    """)
-    
-    ads = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return ads
-
-# def log_click(ad_id: int, advertiser_id: int, session_id: str, clicks_per_session: int, 
-#               time_gap_seconds: float, session_duration_minutes: float,
-#               user_agent_category: int, is_fraud: bool, fraud_probability: float,
-#               risk_level: str, model_used: str) -> int:
-#     """Log a click with fraud analysis results"""
-#     conn = sqlite3.connect(DATABASE_PATH)
-#     cursor = conn.cursor()
-    
-#     cursor.execute("""
-#         INSERT INTO click_logs 
-#         (ad_id, advertiser_id, session_id, clicks_per_session, time_gap_seconds, 
-#          session_duration_minutes, user_agent_category, is_fraud, 
-#          fraud_probability, risk_level, model_used)
-#         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-#     """, (ad_id, advertiser_id, session_id, clicks_per_session, time_gap_seconds,
-#           session_duration_minutes, user_agent_category, is_fraud,
-#           fraud_probability, risk_level, model_used))
-    
-#     click_id = cursor.lastrowid
-#     conn.commit()
-#     conn.close()
-#     return click_id
+    return _get_conn().execute(GET_ADS_SQL).fetchall()
+
+INSERT_CLICK_SQL = """
+    INSERT INTO click_logs 
+    (ad_id, advertiser_id, session_id, clicks_per_session, time_gap_seconds, 
+     session_duration_minutes, user_agent_category, is_fraud, 
+     fraud_probability, risk_level, model_used, clicked_at, ad_title, advertiser_name)
+    VALUES (:ad_id, :advertiser_id, :session_id, :clicks_per_session, :time_gap_seconds,
+            :session_duration_minutes, :user_agent_category, :is_fraud,
+            :fraud_probability, :risk_level, :model_used, :clicked_at,
+            COALESCE(:ad_title, (SELECT title FROM ads WHERE id = :ad_id)),
+            COALESCE(:advertiser_name, (SELECT advertiser_name FROM ads WHERE id = :ad_id)))
+"""
+
+UPSERT_ADVERTISER_ROLLUP_SQL = """
+    INSERT INTO advertiser_rollup (advertiser_id, total_clicks, fraud_clicks, sum_prob)
+    VALUES (:advertiser_id, 1, :is_fraud, :fraud_probability)
+    ON CONFLICT(advertiser_id) DO UPDATE SET
+        total_clicks = total_clicks + 1,
+        fraud_clicks = fraud_clicks + excluded.fraud_clicks,
+        sum_prob = sum_prob + excluded.sum_prob
+"""
+
+UPSERT_AD_ROLLUP_SQL = """
+    INSERT INTO ad_rollup (ad_id, total_clicks, fraud_clicks, sum_prob)
+    VALUES (:ad_id, 1, :is_fraud, :fraud_probability)
+    ON CONFLICT(ad_id) DO UPDATE SET
+        total_clicks = total_clicks + 1,
+        fraud_clicks = fraud_clicks + excluded.fraud_clicks,
+        sum_prob = sum_prob + excluded.sum_prob
+"""
+
 def log_click(ad_id: int, advertiser_id: int, session_id: str, clicks_per_session: int, 
               time_gap_seconds: float, session_duration_minutes: float,
               user_agent_category: int, is_fraud: bool, fraud_probability: float,
-              risk_level: str, model_used: str) -> int:
-    """Log a click with fraud analysis results and update session summary"""
+              risk_level: str, model_used: str, ad_title: Optional[str] = None,
+              advertiser_name: Optional[str] = None) -> int:
+    """Log a click with fraud analysis results and update session summary.
 
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+    ad_title and advertiser_name are looked up from the ad when not given.
+    """
 
-    # Generate IST timestamp
-    ist = pytz.timezone("Asia/Kolkata")
-    clicked_at = datetime.now(ist).strftime("%Y-%m-%d %H:%M:%S")
+    conn = _get_conn()
 
-    # Log individual click
-    cursor.execute("""
-        INSERT INTO click_logs 
-        (ad_id, advertiser_id, session_id, clicks_per_session, time_gap_seconds, 
-         session_duration_minutes, user_agent_category, is_fraud, 
-         fraud_probability, risk_level, model_used, clicked_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        ad_id, advertiser_id, session_id, clicks_per_session,
-        time_gap_seconds, session_duration_minutes,
-        user_agent_category, is_fraud,
-        fraud_probability, risk_level, model_used,
-        clicked_at
-    ))
+    # Epoch timestamp, shared by the click row and its session
+    clicked_at = int(time.time())
+
+    # Click row and session summary commit together
+    with _transaction(conn):
+        # Log individual click
+        cursor = conn.execute(INSERT_CLICK_SQL, {
+            "ad_id": ad_id, "advertiser_id": advertiser_id, "session_id": session_id,
+            "clicks_per_session": clicks_per_session, "time_gap_seconds": time_gap_seconds,
+            "session_duration_minutes": session_duration_minutes,
+            "user_agent_category": user_agent_category, "is_fraud": is_fraud,
+            "fraud_probability": fraud_probability, "risk_level": risk_level,
+            "model_used": model_used, "clicked_at": clicked_at,
+            "ad_title": ad_title, "advertiser_name": advertiser_name
+        })
+
+        click_id = cursor.lastrowid
+    
+        # Bump the dashboard counters
+        conn.execute(UPSERT_ADVERTISER_ROLLUP_SQL, {
+            "advertiser_id": advertiser_id, "is_fraud": is_fraud,
+            "fraud_probability": fraud_probability
+        })
+        conn.execute(UPSERT_AD_ROLLUP_SQL, {
+            "ad_id": ad_id, "is_fraud": is_fraud, "fraud_probability": fraud_probability
+        })
+    
+        # Update session summary
+        update_session_summary(conn, session_id, ad_id, advertiser_id, clicks_per_session,
+                              session_duration_minutes, time_gap_seconds, is_fraud,
+                              fraud_probability, risk_level, model_used,
+                              last_updated=clicked_at, ad_title=ad_title)
 
-    click_id = cursor.lastrowid
-    
-    # Update session summary
-    update_session_summary(cursor, session_id, ad_id, advertiser_id, clicks_per_session,
-                          session_duration_minutes, time_gap_seconds, is_fraud,
-                          fraud_probability, risk_level, model_used)
-    
-    conn.commit()
-    conn.close()
     return click_id
 
-def update_session_summary(cursor, session_id: str, ad_id: int, advertiser_id: int,
+def log_clicks_batch(clicks: List[Dict[str, Any]]) -> None:
+    """Log several clicks in one transaction.
+
+    Each item carries the same keys as the log_click() arguments;
+    ad_title and advertiser_name may be omitted.
+    """
+    if not clicks:
+        return
+
+    conn = _get_conn()
+
+    # One timestamp for the whole batch
+    clicked_at = int(time.time())
+
+    rows = [{"ad_title": None, "advertiser_name": None, **click,
+             "clicked_at": clicked_at, "last_updated": clicked_at} for click in clicks]
+
+    with _transaction(conn):
+        conn.executemany(INSERT_CLICK_SQL, rows)
+        conn.executemany(UPSERT_ADVERTISER_ROLLUP_SQL, rows)
+        conn.executemany(UPSERT_AD_ROLLUP_SQL, rows)
+
+        # Upserts run in list order, so later clicks of a session fold onto earlier ones
+        conn.executemany(UPSERT_SESSION_SQL, rows)
+
+# One statement creates or folds a click into its session: min_gap only moves
+# for positive gaps, and once a session is flagged as fraud it stays fraud
+UPSERT_SESSION_SQL = """
+    INSERT INTO session_summary 
+    (session_id, ad_id, advertiser_id, ad_title, clicks_per_session,
+     session_duration_minutes, min_gap, max_gap, is_fraud,
+     fraud_probability, risk_level, model_used, last_updated)
+    VALUES (:session_id, :ad_id, :advertiser_id,
+            COALESCE(:ad_title, (SELECT title FROM ads WHERE id = :ad_id)),
+            :clicks_per_session, :session_duration_minutes, 999999, 0, :is_fraud,
+            :fraud_probability, :risk_level, :model_used, :last_updated)
+    ON CONFLICT(session_id) DO UPDATE SET
+        clicks_per_session = excluded.clicks_per_session,
+        session_duration_minutes = excluded.session_duration_minutes,
+        min_gap = CASE WHEN :time_gap_seconds > 0 THEN MIN(min_gap, :time_gap_seconds) ELSE min_gap END,
+        max_gap = MAX(max_gap, :time_gap_seconds),
+        is_fraud = is_fraud OR excluded.is_fraud,
+        fraud_probability = excluded.fraud_probability,
+        risk_level = excluded.risk_level,
+        model_used = excluded.model_used,
+        last_updated = excluded.last_updated
+"""
+
+def update_session_summary(conn, session_id: str, ad_id: int, advertiser_id: int,
                           clicks_per_session: int, session_duration_minutes: float,
                           time_gap_seconds: float, is_fraud: bool, fraud_probability: float,
-                          risk_level: str, model_used: str):
+                          risk_level: str, model_used: str, last_updated: Optional[int] = None,
+                          ad_title: Optional[str] = None):
     """Update or create session summary with min/max gap tracking and fraud persistence"""
     
-    # Get ad title
-    cursor.execute("SELECT title FROM ads WHERE id = ?", (ad_id,))
-    ad_title = cursor.fetchone()[0]
-    
-    # Check if session exists
-    cursor.execute("SELECT min_gap, max_gap, is_fraud FROM session_summary WHERE session_id = ?", (session_id,))
-    existing = cursor.fetchone()
-    
-    if existing:
-        current_min_gap, current_max_gap, existing_fraud = existing
-        
-        # Update min/max gaps - only update min_gap if current gap is positive
-        new_min_gap = min(current_min_gap, time_gap_seconds) if time_gap_seconds > 0 else current_min_gap
-        new_max_gap = max(current_max_gap, time_gap_seconds)
-        
-        # Once fraud is detected, it stays fraud
-        final_is_fraud = existing_fraud or is_fraud
-        final_fraud_prob = fraud_probability if final_is_fraud else fraud_probability
-        final_risk_level = risk_level if final_is_fraud else risk_level
-        
-        cursor.execute("""
-            UPDATE session_summary SET
-                clicks_per_session = ?,
-                session_duration_minutes = ?,
-                min_gap = ?,
-                max_gap = ?,
-                is_fraud = ?,
-                fraud_probability = ?,
-                risk_level = ?,
-                model_used = ?,
-                last_updated = ?
-            WHERE session_id = ?
-        """, (clicks_per_session, session_duration_minutes, new_min_gap, new_max_gap,
-              final_is_fraud, final_fraud_prob, final_risk_level, model_used, 
-              datetime.now(pytz.timezone("Asia/Kolkata")).strftime("%Y-%m-%d %H:%M:%S"),
-              session_id))
-    else:
-        # Create new session summary - first click has 0 gap
-        cursor.execute("""
-            INSERT INTO session_summary 
-            (session_id, ad_id, advertiser_id, ad_title, clicks_per_session,
-             session_duration_minutes, min_gap, max_gap, is_fraud,
-             fraud_probability, risk_level, model_used)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (session_id, ad_id, advertiser_id, ad_title, clicks_per_session,
-              session_duration_minutes, 999999, 0,
-              is_fraud, fraud_probability, risk_level, model_used))
+    if last_updated is None:
+        last_updated = int(time.time())
+    
+    conn.execute(UPSERT_SESSION_SQL, {
+        "session_id": session_id, "ad_id": ad_id, "advertiser_id": advertiser_id,
+        "clicks_per_session": clicks_per_session,
+        "session_duration_minutes": session_duration_minutes,
+        "time_gap_seconds": time_gap_seconds, "is_fraud": is_fraud,
+        "fraud_probability": fraud_probability, "risk_level": risk_level,
+        "model_used": model_used,
+        "last_updated": last_updated, "ad_title": ad_title
+    })
 
 
+ADVERTISER_TOTALS_SQL = """
+    SELECT 
+        total_clicks,
+        fraud_clicks,
+        total_clicks - fraud_clicks as genuine_clicks,
+        sum_prob / total_clicks as avg_fraud_prob
+    FROM advertiser_rollup
+    WHERE advertiser_id = ?
+"""
+
+ADVERTISER_AD_BREAKDOWN_SQL = """
+    SELECT 
+        a.id, a.title,
+        COALESCE(r.total_clicks, 0) as clicks,
+        COALESCE(r.fraud_clicks, 0) as fraud_clicks,
+        COALESCE(r.total_clicks - r.fraud_clicks, 0) as genuine_clicks,
+        r.sum_prob / r.total_clicks as avg_fraud_prob
+    FROM ads a
+    LEFT JOIN ad_rollup r ON r.ad_id = a.id
+    WHERE a.advertiser_id = ?
+    ORDER BY clicks DESC
+"""
+
 def get_advertiser_stats(advertiser_id: int) -> Dict[str, Any]:
     """Get click statistics for an advertiser"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    conn = _get_conn()
     
     # Overall stats
-    cursor.execute("""
-        SELECT 
-            COUNT(*) as total_clicks,
-            SUM(CASE WHEN is_fraud = 1 THEN 1 ELSE 0 END) as fraud_clicks,
-            SUM(CASE WHEN is_fraud = 0 THEN 1 ELSE 0 END) as genuine_clicks,
-            AVG(fraud_probability) as avg_fraud_prob
-        FROM click_logs cl
-        JOIN ads a ON cl.ad_id = a.id
-        WHERE a.advertiser_id = ?
-    """, (advertiser_id,))
-    
-    stats = dict(cursor.fetchone())
+    totals = conn.execute(ADVERTISER_TOTALS_SQL, (advertiser_id,)).fetchone()
+    if totals:
+        stats = dict(totals)
+    else:
+        stats = {'total_clicks': 0, 'fraud_clicks': 0, 'genuine_clicks': 0, 'avg_fraud_prob': None}
     
     # Per-ad breakdown
-    cursor.execute("""
-        SELECT 
-            a.id, a.title,
-            COUNT(*) as clicks,
-            SUM(CASE WHEN cl.is_fraud = 1 THEN 1 ELSE 0 END) as fraud_clicks,
-            AVG(cl.fraud_probability) as avg_fraud_prob
-        FROM ads a
-        LEFT JOIN click_logs cl ON a.id = cl.ad_id
-        WHERE a.advertiser_id = ?
-        GROUP BY a.id, a.title
-        ORDER BY clicks DESC
-    """, (advertiser_id,))
-    
-    stats['ads'] = [dict(row) for row in cursor.fetchall()]
+    stats['ads'] = conn.execute(ADVERTISER_AD_BREAKDOWN_SQL, (advertiser_id,)).fetchall()
     
-    conn.close()
     return stats
 
-def get_recent_clicks(advertiser_id: int, limit: int = 50) -> List[Dict[str, Any]]:
-    """Get recent session summaries for an advertiser"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    try:
-        print(f"Querying session_summary for advertiser_id: {advertiser_id}")
-        cursor.execute("""
-            SELECT *
-            FROM session_summary
-            WHERE advertiser_id = ?
-            ORDER BY last_updated DESC
-            LIMIT ?
-        """, (advertiser_id, limit))
+# last_updated is returned as an IST string for the dashboard; ORDER BY names
+# the stored column so the sort still comes from idx_session_summary_recent
+RECENT_SESSIONS_SQL = f"""
+    SELECT
+        id, session_id, ad_id, advertiser_id, ad_title, clicks_per_session,
+        session_duration_minutes, min_gap, max_gap, is_fraud,
+        fraud_probability, risk_level, model_used,
+        datetime(last_updated, 'unixepoch', '+{IST_OFFSET_MINUTES} minutes') as last_updated
+    FROM session_summary
+    WHERE advertiser_id = ?
+    ORDER BY session_summary.last_updated DESC
+    LIMIT ?
+"""
+
+def get_recent_clicks(advertiser_id: int, limit: int = 50) -> Iterator[Dict[str, Any]]:
+    """Yield recent session summaries for an advertiser, newest first.
         
-        sessions = [dict(row) for row in cursor.fetchall()]
-        print(f"Found {len(sessions)} sessions in database")
-        conn.close()
-        return sessions
-    except Exception as e:
-        print(f"Error in get_recent_clicks: {e}")
-        conn.close()
-        return []
+    Rows are read from the cursor as they are consumed; the cursor is closed
+    once the generator is exhausted or discarded.
+    """
+    with closing(_get_conn().execute(RECENT_SESSIONS_SQL, (advertiser_id, limit))) as cursor:
+        for row in cursor:
+            yield dict(row)
 
 # Authentication functions
+
+# scrypt cost parameters and salt length for stored password hashes
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+
+def _scrypt(password: str, salt: bytes) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+
 def hash_password(password: str) -> str:
-    """Hash password using SHA-256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash password using scrypt with a random per-user salt"""
+    salt = os.urandom(SALT_BYTES)
+    return f"scrypt${salt.hex()}${_scrypt(password, salt).hex()}"
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """Check password against a stored hash (scrypt, or legacy unsalted SHA-256)"""
+    if password_hash.startswith("scrypt$"):
+        _, salt, expected = password_hash.split("$")
+        return hmac.compare_digest(_scrypt(password, bytes.fromhex(salt)).hex(), expected)
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), password_hash)
+
+def is_legacy_hash(password_hash: str) -> bool:
+    return not password_hash.startswith("scrypt$")
+
+# Shared by the sample advertisers, so seeding hashes the demo password once
+DEMO_PASSWORD_HASH = hash_password("demo123")
+
+INSERT_ADVERTISER_SQL = "INSERT INTO advertisers (name, email, password_hash) VALUES (?, ?, ?)"
 
 def create_advertiser(name: str, email: str, password: str) -> Optional[int]:
     """Create new advertiser account"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
     try:
         password_hash = hash_password(password)
-        cursor.execute(
-            "INSERT INTO advertisers (name, email, password_hash) VALUES (?, ?, ?)",
-            (name, email, password_hash)
-        )
-        advertiser_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return advertiser_id
+        cursor = _get_conn().execute(INSERT_ADVERTISER_SQL, (name, email, password_hash))
+        return cursor.lastrowid
     except sqlite3.IntegrityError:
-        conn.close()
         return None  # Email already exists
 
+AUTHENTICATE_ADVERTISER_SQL = "SELECT id, name, email, password_hash FROM advertisers WHERE email = ?"
+
+UPDATE_PASSWORD_HASH_SQL = "UPDATE advertisers SET password_hash = ? WHERE id = ?"
+
 def authenticate_advertiser(email: str, password: str) -> Optional[Dict[str, Any]]:
     """Authenticate advertiser login"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    password_hash = hash_password(password)
-    cursor.execute(
-        "SELECT id, name, email FROM advertisers WHERE email = ? AND password_hash = ?",
-        (email, password_hash)
-    )
+    conn = _get_conn()
+    advertiser = conn.execute(AUTHENTICATE_ADVERTISER_SQL, (email,)).fetchone()
+    if not advertiser or not verify_password(password, advertiser["password_hash"]):
+        return None
     
-    advertiser = cursor.fetchone()
-    conn.close()
+    # Upgrade legacy SHA-256 hashes now that the password is known
+    if is_legacy_hash(advertiser["password_hash"]):
+        conn.execute(UPDATE_PASSWORD_HASH_SQL, (hash_password(password), advertiser["id"]))
     
-    return dict(advertiser) if advertiser else None
+    return {"id": advertiser["id"], "name": advertiser["name"], "email": advertiser["email"]}
+
+ADVERTISER_BY_ID_SQL = "SELECT id, name, email FROM advertisers WHERE id = ?"
 
 def get_advertiser_by_id(advertiser_id: int) -> Optional[Dict[str, Any]]:
     """Get advertiser by ID"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        "SELECT id, name, email FROM advertisers WHERE id = ?",
-        (advertiser_id,)
-    )
-    
-    advertiser = cursor.fetchone()
-    conn.close()
+    advertiser = _get_conn().execute(ADVERTISER_BY_ID_SQL, (advertiser_id,)).fetchone()
     
     return dict(advertiser) if advertiser else None
 
 # Ad management functions
+INSERT_AD_SQL = """
+    INSERT INTO ads (advertiser_id, title, description, image_url, target_url, advertiser_name)
+    VALUES (?1, ?2, ?3, ?4, ?5, (SELECT name FROM advertisers WHERE id = ?1))
+"""
+
 def create_ad(advertiser_id: int, title: str, description: str, image_url: str, target_url: str) -> int:
     """Create new ad for advertiser"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        INSERT INTO ads (advertiser_id, title, description, image_url, target_url)
-        VALUES (?, ?, ?, ?, ?)
-    """, (advertiser_id, title, description, image_url, target_url))
+    cursor = _get_conn().execute(INSERT_AD_SQL, (advertiser_id, title, description, image_url, target_url))
     
-    ad_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return ad_id
+    return cursor.lastrowid
 
-def get_advertiser_ads(advertiser_id: int) -> List[Dict[str, Any]]:
+ADVERTISER_ADS_SQL = """
+    SELECT 
+        a.*,
+        COALESCE(r.total_clicks, 0) as total_clicks,
+        COALESCE(r.fraud_clicks, 0) as fraud_clicks,
+        COALESCE(r.total_clicks - r.fraud_clicks, 0) as genuine_clicks,
+        COALESCE(r.sum_prob / r.total_clicks, 0) as avg_fraud_prob
+    FROM ads a
+    LEFT JOIN ad_rollup r ON r.ad_id = a.id
+    WHERE a.advertiser_id = ?
+    ORDER BY a.created_at DESC
+"""
+
+def get_advertiser_ads(advertiser_id: int) -> List[sqlite3.Row]:
     """Get all ads for specific advertiser with click statistics"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT 
-            a.*,
-            COALESCE(COUNT(cl.id), 0) as total_clicks,
-            COALESCE(SUM(CASE WHEN cl.is_fraud = 1 THEN 1 ELSE 0 END), 0) as fraud_clicks,
-            COALESCE(SUM(CASE WHEN cl.is_fraud = 0 THEN 1 ELSE 0 END), 0) as genuine_clicks,
-            COALESCE(AVG(cl.fraud_probability), 0) as avg_fraud_prob
-        FROM ads a
-        LEFT JOIN click_logs cl ON a.id = cl.ad_id
-        WHERE a.advertiser_id = ?
-        GROUP BY a.id, a.title, a.description, a.image_url, a.target_url, a.is_active, a.created_at
-        ORDER BY a.created_at DESC
-    """, (advertiser_id,))
-    
-    ads = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return ads
+    return _get_conn().execute(ADVERTISER_ADS_SQL, (advertiser_id,)).fetchall()
+
+AD_WITH_ADVERTISER_SQL = "SELECT * FROM ads WHERE id = ?"
 
-def get_ad_with_advertiser(ad_id: int) -> Optional[Dict[str, Any]]:
+def get_ad_with_advertiser(ad_id: int) -> Optional[sqlite3.Row]:
     """Get ad with advertiser info for click tracking"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT a.*, adv.name as advertiser_name 
-        FROM ads a 
-        JOIN advertisers adv ON a.advertiser_id = adv.id 
-        WHERE a.id = ?
-    """, (ad_id,))
-    
-    ad = cursor.fetchone()
-    conn.close()
-    return dict(ad) if ad else None
+    return _get_conn().execute(AD_WITH_ADVERTISER_SQL, (ad_id,)).fetchone()
+
+ALL_ADS_SQL = "SELECT * FROM ads"
+
+def get_ads_for_cache() -> List[sqlite3.Row]:
+    """Get every ad, active or not, with advertiser info"""
+    return _get_conn().execute(ALL_ADS_SQL).fetchall()
 
 if __name__ == "__main__":
     print("Initializing database...")
@@ -1,7 +1,59 @@
-import pandas as pd
+import numpy as np
 from datetime import datetime
 
 
+# Column layout of the fitted ANN preprocessor (training/ann_preprocessor.pkl):
+# scaled numeric columns first, then one-hot blocks per categorical column.
+NUMERIC_COLUMNS = (
+    "click_duration", "scroll_depth", "mouse_movement", "keystrokes_detected",
+    "click_frequency", "time_since_last_click", "bot_likelihood_score",
+    "VPN_usage", "proxy_usage",
+)
+CATEGORICAL_COLUMNS = (
+    "device_type", "browser", "operating_system", "ad_position", "device_ip_reputation",
+)
+# OneHotEncoder categories learned during training, in encoder order
+CATEGORIES = {
+    "device_type": ("Desktop", "Mobile", "Tablet"),
+    "browser": ("Chrome", "Edge", "Firefox", "Opera", "Safari"),
+    "operating_system": ("Android", "Linux", "Windows", "iOS", "macOS"),
+    "ad_position": ("Bottom", "Side", "Top"),
+    "device_ip_reputation": ("Bad", "Good", "Suspicious"),
+}
+
+N_NUMERIC = len(NUMERIC_COLUMNS)
+N_FEATURES = N_NUMERIC + sum(len(CATEGORIES[col]) for col in CATEGORICAL_COLUMNS)
+
+
+def _one_hot_positions():
+    """Map each category value to its column in the encoded feature vector"""
+    positions = []
+    offset = N_NUMERIC
+    for col in CATEGORICAL_COLUMNS:
+        positions.append({value: offset + i for i, value in enumerate(CATEGORIES[col])})
+        offset += len(CATEGORIES[col])
+    return tuple(positions)
+
+
+_ONE_HOT_POSITIONS = _one_hot_positions()
+
+# user_agent_category 1 is Desktop, 2 is Mobile and anything else is Tablet;
+# indexed by the category clipped to 0..3
+DEVICE_TYPES = ("Tablet", "Desktop", "Mobile", "Tablet")
+
+# Values derived from the bot-score thresholds, indexed by the boolean test
+_REPUTATION = ("Good", "Bad")     # bot_score > 0.6
+_KEYSTROKES = (2, 0)              # bot_score > 0.6
+_ANONYMIZER = (0, 1)              # bot_score > 0.7, VPN_usage and proxy_usage
+
+# Encoded column of each derived categorical value, for the batch path
+_DEVICE_POSITIONS = np.array([_ONE_HOT_POSITIONS[0][device] for device in DEVICE_TYPES])
+_FIXED_POSITIONS = [_ONE_HOT_POSITIONS[1]["Chrome"], _ONE_HOT_POSITIONS[2]["Windows"],
+                    _ONE_HOT_POSITIONS[3]["Top"]]
+_REPUTATION_GOOD = _ONE_HOT_POSITIONS[4]["Good"]
+_REPUTATION_BAD = _ONE_HOT_POSITIONS[4]["Bad"]
+
+
 class FeatureBuilder:
     """
     Converts minimal backend inputs into the full
@@ -9,60 +61,114 @@ class FeatureBuilder:
     """
 
     @staticmethod
-    def build(click):
+    def _derive(click):
+        """Derive (numeric values, categorical values) in schema column order"""
         # Derive behavior patterns
         click_frequency = click.clicks_per_session / max(click.session_duration_minutes, 0.1)
 
-        bot_score = 0.0
-        if click.clicks_per_session > 10:
-            bot_score += 0.3
-        if click.time_gap_seconds < 1.0:
-            bot_score += 0.4
-        if click_frequency > 8:
-            bot_score += 0.3
-        bot_score = min(bot_score, 1.0)
+        # Booleans add as 0/1, so the score needs no branches
+        bot_score = min(0.3 * (click.clicks_per_session > 10)
+                        + 0.4 * (click.time_gap_seconds < 1.0)
+                        + 0.3 * (click_frequency > 8), 1.0)
+        likely_bot = bot_score > 0.6
+        uses_proxy = _ANONYMIZER[bot_score > 0.7]
 
         # Deterministic categorical inference
-        if click.user_agent_category == 1:
-            device_type = "Desktop"
-        elif click.user_agent_category == 2:
-            device_type = "Mobile"
-        else:
-            device_type = "Tablet"
+        device_type = DEVICE_TYPES[min(max(click.user_agent_category, 0), 3)]
 
         browser = "Chrome"
         operating_system = "Windows"
 
         ad_position = "Top"
-        device_ip_reputation = "Bad" if bot_score > 0.6 else "Good"
-
-        # Final feature row (MATCHES TRAINING SCHEMA FOR ANN)
-        # Required numeric columns:
-        # 'click_duration', 'scroll_depth', 'mouse_movement', 'keystrokes_detected',
-        # 'click_frequency', 'time_since_last_click', 'bot_likelihood_score',
-        # 'VPN_usage', 'proxy_usage'
-        #
-        # Required categorical columns:
-        # 'device_type', 'browser', 'operating_system', 'ad_position', 'device_ip_reputation'
-
-        row = {
-            "device_type": device_type,
-            "browser": browser,
-            "operating_system": operating_system,
-            "ad_position": ad_position,
-            "device_ip_reputation": device_ip_reputation,
-
-            "click_duration": click.time_gap_seconds,
-            "scroll_depth": min(click.clicks_per_session * 10, 100),
-            "mouse_movement": min(click.clicks_per_session * 40, 400),
-            "keystrokes_detected": 0 if bot_score > 0.6 else 2,
-
-            "click_frequency": click_frequency,
-            "time_since_last_click": click.time_gap_seconds,
-
-            "VPN_usage": 1 if bot_score > 0.7 else 0,
-            "proxy_usage": 1 if bot_score > 0.7 else 0,
-            "bot_likelihood_score": bot_score,
-        }
+        device_ip_reputation = _REPUTATION[likely_bot]
+
+        numeric = (
+            click.time_gap_seconds,                       # click_duration
+            min(click.clicks_per_session * 10, 100),      # scroll_depth
+            min(click.clicks_per_session * 40, 400),      # mouse_movement
+            _KEYSTROKES[likely_bot],                      # keystrokes_detected
+            click_frequency,                              # click_frequency
+            click.time_gap_seconds,                       # time_since_last_click
+            bot_score,                                    # bot_likelihood_score
+            uses_proxy,                                   # VPN_usage
+            uses_proxy,                                   # proxy_usage
+        )
+        categorical = (device_type, browser, operating_system, ad_position, device_ip_reputation)
+        return numeric, categorical
+
+    @staticmethod
+    def build_array(click) -> np.ndarray:
+        """
+        Build the encoded (1, N_FEATURES) float32 row for one click.
+
+        Numeric columns are left unscaled; the one-hot block matches the
+        preprocessor's encoder, with unknown categories left all-zero.
+        The service encodes with build_batch(); this is kept as its scalar
+        reference.
+        """
+        numeric, categorical = FeatureBuilder._derive(click)
+
+        out = np.zeros((1, N_FEATURES), dtype=np.float32)
+        out[0, :N_NUMERIC] = numeric
+        for positions, value in zip(_ONE_HOT_POSITIONS, categorical):
+            index = positions.get(value)
+            if index is not None:
+                out[0, index] = 1.0
+        return out
+
+    @staticmethod
+    def build(click):
+        """
+        Build the raw one-row DataFrame expected by the fitted preprocessor.
+
+        Only for offline use with the preprocessor; the serving path uses
+        build_batch(), so pandas is imported here on demand.
+        """
+        import pandas as pd
 
+        numeric, categorical = FeatureBuilder._derive(click)
+        row = dict(zip(CATEGORICAL_COLUMNS, categorical))
+        row.update(zip(NUMERIC_COLUMNS, numeric))
         return pd.DataFrame([row])
+
+    @staticmethod
+    def build_batch(clicks, out=None) -> np.ndarray:
+        """
+        Vectorized build_array() for a sequence of clicks.
+
+        Returns a (len(clicks), N_FEATURES) float32 matrix with the same
+        rows build_array() would produce one at a time. If out is given,
+        the rows are written into that array instead of a new one.
+        """
+        n = len(clicks)
+        clicks_per_session = np.fromiter((c.clicks_per_session for c in clicks), np.float64, n)
+        time_gap = np.fromiter((c.time_gap_seconds for c in clicks), np.float64, n)
+        duration = np.fromiter((c.session_duration_minutes for c in clicks), np.float64, n)
+        user_agent = np.fromiter((c.user_agent_category for c in clicks), np.int64, n)
+
+        click_frequency = clicks_per_session / np.maximum(duration, 0.1)
+        bot_score = np.minimum(0.3 * (clicks_per_session > 10)
+                               + 0.4 * (time_gap < 1.0)
+                               + 0.3 * (click_frequency > 8), 1.0)
+        likely_bot = bot_score > 0.6
+        uses_proxy = bot_score > 0.7
+
+        if out is None:
+            out = np.zeros((n, N_FEATURES), dtype=np.float32)
+        else:
+            out[:, N_NUMERIC:] = 0.0
+        out[:, 0] = time_gap                                      # click_duration
+        out[:, 1] = np.minimum(clicks_per_session * 10, 100)      # scroll_depth
+        out[:, 2] = np.minimum(clicks_per_session * 40, 400)      # mouse_movement
+        out[:, 3] = np.where(likely_bot, 0, 2)                    # keystrokes_detected
+        out[:, 4] = click_frequency                               # click_frequency
+        out[:, 5] = time_gap                                      # time_since_last_click
+        out[:, 6] = bot_score                                     # bot_likelihood_score
+        out[:, 7] = uses_proxy                                    # VPN_usage
+        out[:, 8] = uses_proxy                                    # proxy_usage
+
+        rows = np.arange(n)
+        out[rows, _DEVICE_POSITIONS[np.clip(user_agent, 0, 3)]] = 1.0
+        out[:, _FIXED_POSITIONS] = 1.0
+        out[rows, np.where(likely_bot, _REPUTATION_BAD, _REPUTATION_GOOD)] = 1.0
+        return out
@@ -4,26 +4,228 @@ Keras Model Loader with Compatibility Fixes
 import tensorflow as tf
 from tensorflow import keras
 import numpy as np
-import pandas as pd
+import os
+import tempfile
+import threading
+
+DEFAULT_MODEL_PATH = "training/ann_click_fraud_model.h5"
+
+# Loaded models, traced inference functions and NumPy ports by path,
+# shared by every caller in the process
+_MODELS = {}
+_INFERENCE_FNS = {}
+_NUMPY_MODELS = {}
+_LOCK = threading.Lock()
 
 def load_keras_model_safe(model_path):
     """Load Keras model with compatibility handling"""
     try:
-        # Try loading with custom objects if needed
-        model = keras.models.load_model(model_path, compile=False)
-        
-        # Recompile the model
-        model.compile(
-            optimizer='adam',
-            loss='binary_crossentropy',
-            metrics=['accuracy']
-        )
-        
-        return model
+        # Inference only: compiling would just build optimizer/metric state
+        return keras.models.load_model(model_path, compile=False)
     except Exception as e:
         print(f"Keras loading error: {e}")
         return None
 
+class TFLiteModel:
+    """
+    tf.lite.Interpreter wrapper with a Keras-like predict().
+
+    Takes and returns float32 arrays; for full-int8 models quantization of
+    the input and dequantization of the output happen here.
+    """
+
+    def __init__(self, model_path, batch_size=32):
+        self.interpreter = tf.lite.Interpreter(model_path=model_path)
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        # Tensors are allocated once at a fixed batch size and smaller
+        # batches are padded, since resizing reallocates on every change
+        self._batch_size = batch_size
+        self.interpreter.resize_tensor_input(
+            self._input["index"], (batch_size, self._input["shape"][1]))
+        self.interpreter.allocate_tensors()
+        self._buffer = np.zeros((batch_size, self._input["shape"][1]), dtype=self._input["dtype"])
+        # The interpreter and buffer are reused, so one invoke at a time
+        self._lock = threading.Lock()
+
+    @property
+    def input_shape(self):
+        return (None, int(self._input["shape"][1]))
+
+    def predict(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        scale, zero_point = self._input["quantization"]
+        if scale:
+            info = np.iinfo(self._input["dtype"])
+            x = np.clip(np.round(x / scale + zero_point), info.min, info.max)
+
+        outputs = []
+        with self._lock:
+            for start in range(0, len(x), self._batch_size):
+                chunk = x[start:start + self._batch_size]
+                # Rows past len(chunk) hold stale input; their outputs are dropped
+                self._buffer[:len(chunk)] = chunk
+                self.interpreter.set_tensor(self._input["index"], self._buffer)
+                self.interpreter.invoke()
+                outputs.append(self.interpreter.get_tensor(self._output["index"])[:len(chunk)])
+        if outputs:
+            y = np.concatenate(outputs)
+        else:
+            y = np.empty((0, *self._output["shape"][1:]), dtype=self._output["dtype"])
+
+        scale, zero_point = self._output["quantization"]
+        if scale:
+            return (y.astype(np.float32) - zero_point) * scale
+        return y.astype(np.float32)
+
+class NumpyMLP:
+    """
+    Forward pass of a Dense-only Keras model in plain NumPy.
+
+    Weights are copied out once as float32; Dropout layers are skipped since
+    they are identity at inference time.
+    """
+
+    ACTIVATIONS = ("linear", "relu", "sigmoid")
+
+    def __init__(self, layers):
+        # [(kernel, bias, activation)] in forward order
+        self.layers = layers
+
+    @classmethod
+    def from_keras(cls, model):
+        layers = []
+        for layer in model.layers:
+            if isinstance(layer, keras.layers.Dropout):
+                continue
+            if not isinstance(layer, keras.layers.Dense):
+                raise ValueError(f"Unsupported layer for NumpyMLP: {layer.__class__.__name__}")
+            activation = layer.get_config()["activation"]
+            if activation not in cls.ACTIVATIONS:
+                raise ValueError(f"Unsupported activation for NumpyMLP: {activation}")
+            kernel, bias = layer.get_weights()
+            layers.append((kernel.astype(np.float32), bias.astype(np.float32), activation))
+        return cls(layers)
+
+    @property
+    def input_shape(self):
+        return (None, self.layers[0][0].shape[0])
+
+    def predict(self, x):
+        h = np.asarray(x, dtype=np.float32)
+        for kernel, bias, activation in self.layers:
+            h = h @ kernel + bias
+            if activation == "relu":
+                np.maximum(h, 0, out=h)
+            elif activation == "sigmoid":
+                # 1 / (1 + exp(-h)) without overflow for large negative logits
+                h = np.exp(-np.logaddexp(0, -h))
+        return h
+
+def convert_to_tflite(model, output_path, representative_data=None, max_samples=500):
+    """
+    Convert model to a TFLite FlatBuffer at output_path.
+
+    By default weights are stored as float16 and inference stays in float.
+    With representative_data (a preprocessed float32 feature matrix, up to
+    max_samples rows used for calibration) the model is quantized to full
+    int8 instead; its input then shares one int8 scale across all features.
+    """
+    def representative_dataset():
+        for row in representative_data[:max_samples]:
+            yield [np.asarray(row, dtype=np.float32)[np.newaxis]]
+
+    # TFLiteConverter.from_keras_model fails on Keras 3 models, so convert
+    # from an exported SavedModel instead
+    with tempfile.TemporaryDirectory() as export_dir:
+        model.export(export_dir)
+        converter = tf.lite.TFLiteConverter.from_saved_model(export_dir)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if representative_data is None:
+            converter.target_spec.supported_types = [tf.float16]
+        else:
+            converter.representative_dataset = representative_dataset
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            converter.inference_input_type = tf.int8
+            converter.inference_output_type = tf.int8
+        tflite_model = converter.convert()
+
+    with open(output_path, "wb") as f:
+        f.write(tflite_model)
+    return output_path
+
+def load_tflite_model_safe(model_path):
+    """Load a TFLite model, returning None if it cannot be opened"""
+    try:
+        return TFLiteModel(model_path)
+    except Exception as e:
+        print(f"TFLite loading error: {e}")
+        return None
+
+def get_model(model_path=DEFAULT_MODEL_PATH):
+    """
+    Return the model at model_path, loading it from disk on first use.
+
+    .tflite files load as a TFLiteModel, anything else as a Keras model.
+    """
+    model = _MODELS.get(model_path)
+    if model is None:
+        with _LOCK:
+            model = _MODELS.get(model_path)
+            if model is None:
+                if os.path.splitext(model_path)[1] == ".tflite":
+                    model = load_tflite_model_safe(model_path)
+                else:
+                    model = load_keras_model_safe(model_path)
+                if model is not None:
+                    _MODELS[model_path] = model
+    return model
+
+def make_inference_fn(model, jit_compile=False):
+    """
+    Wrap model in a tf.function traced once for (batch, n_features) float32
+    input, so calls skip Keras predict() overhead and never retrace.
+
+    With jit_compile the graph is compiled by XLA, once per batch size seen.
+    """
+    n_features = model.input_shape[1]
+
+    @tf.function(input_signature=[tf.TensorSpec(shape=(None, n_features), dtype=tf.float32)],
+                 jit_compile=jit_compile)
+    def infer(x):
+        return model(x, training=False)
+
+    return infer
+
+def get_inference_fn(model_path=DEFAULT_MODEL_PATH, jit_compile=False):
+    """Return the cached inference function for the Keras model at model_path"""
+    key = (model_path, jit_compile)
+    infer = _INFERENCE_FNS.get(key)
+    if infer is None:
+        model = get_model(model_path)
+        if model is None:
+            return None
+        with _LOCK:
+            infer = _INFERENCE_FNS.get(key)
+            if infer is None:
+                infer = make_inference_fn(model, jit_compile=jit_compile)
+                _INFERENCE_FNS[key] = infer
+    return infer
+
+def get_numpy_model(model_path=DEFAULT_MODEL_PATH):
+    """Return the cached NumpyMLP port of the Keras model at model_path"""
+    numpy_model = _NUMPY_MODELS.get(model_path)
+    if numpy_model is None:
+        model = get_model(model_path)
+        if model is None:
+            return None
+        with _LOCK:
+            numpy_model = _NUMPY_MODELS.get(model_path)
+            if numpy_model is None:
+                numpy_model = NumpyMLP.from_keras(model)
+                _NUMPY_MODELS[model_path] = numpy_model
+    return numpy_model
+
 def create_compatible_model():
     """Create a simple compatible model for testing"""
     model = keras.Sequential([
@@ -4,72 +4,174 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel, EmailStr
 import joblib
-import pandas as pd
 import numpy as np
 from typing import Dict, Any
+from itsdangerous import BadSignature, TimestampSigner
+import asyncio
+import json
+import logging
 import os
-import uuid
+import secrets
 
 from database import (
-    init_database, insert_sample_data, get_ads, log_click,
+    init_database, insert_sample_data, get_ads, log_clicks_batch,
     get_advertiser_stats, get_recent_clicks, create_advertiser,
     authenticate_advertiser, create_ad,
-    get_advertiser_ads, get_ad_with_advertiser
+    get_advertiser_ads, get_ad_with_advertiser, get_ads_for_cache
 )
-from feature_builder import FeatureBuilder
-from keras_loader import load_keras_model_safe
+from feature_builder import FeatureBuilder, CATEGORIES, CATEGORICAL_COLUMNS, N_NUMERIC, N_FEATURES
+from keras_loader import get_model, get_inference_fn, get_numpy_model
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 # -------------------- FASTAPI APP --------------------
 
 app = FastAPI(title="Ad Click Fraud Detection API", version="1.0.0")
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# The dashboards are served from this origin, so CORS is only needed when
+# other sites call the API; list them comma-separated in CORS_ORIGINS
+CORS_ORIGINS = [origin.strip() for origin in os.environ.get("CORS_ORIGINS", "").split(",")
+                if origin.strip()]
+if CORS_ORIGINS:
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=CORS_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
 
 # -------------------- GLOBALS --------------------
 
+# Static assets are served by the reverse proxy in production (see
+# deploy/nginx.conf); set SERVE_STATIC=0 there. Local runs serve them here.
+SERVE_STATIC = os.environ.get("SERVE_STATIC", "1") == "1"
+
+MODEL_PATH = "training/ann_click_fraud_model.h5"
+# TFLite build of MODEL_PATH, produced by training/convert_tflite.py
+TFLITE_MODEL_PATH = "training/ann.tflite"
+# MODEL_PATH with the numeric scaling folded into its first layer, produced
+# by training/fuse_scaler.py; it takes unscaled features
+FUSED_MODEL_PATH = "training/ann_click_fraud_model_fused.h5"
+
+# Inference backend: "numpy" (NumpyMLP port of the Keras model), "tflite"
+# (TFLite interpreter) or "keras" (XLA-compiled tf.function)
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "numpy")
+
 model = {
     "classifier": None,
-    "scaler": None
+    "predict_fn": None,
+    "scaler": None,
+    "num_mean": None,
+    "num_inv_scale": None,
+    # Set once by load_model, so requests never inspect the classifier
+    "ready": False,
+    "info": None
 }
 
 model_name = None
-sessions = {}
+
+# Session cookies carry the signed advertiser record, so any worker can
+# authenticate a request without shared session state. Set SESSION_SECRET
+# to keep sessions valid across restarts and multiple workers.
+SESSION_SECRET = os.environ.get("SESSION_SECRET")
+if not SESSION_SECRET:
+    logger.warning("SESSION_SECRET not set, using a per-process secret")
+    SESSION_SECRET = secrets.token_hex(32)
+SESSION_MAX_AGE = 86400  # 24 hours
+session_signer = TimestampSigner(SESSION_SECRET)
+
+# ad_id -> ads row, so /predict needs no query to find an ad's advertiser.
+# Filled at startup and on /ads/create; ads created through another worker
+# are picked up from the database on first use.
+AD_CACHE: Dict[int, Any] = {}
+
+# Largest number of queued /predict rows run through the model in one call
+MAX_BATCH_SIZE = 32
+
+# (ClickData, future) pairs waiting for prediction_batcher
+batch_queue: asyncio.Queue = asyncio.Queue()
+batcher_task = None
+
+# Largest number of logged clicks written in one transaction
+MAX_LOG_BATCH_SIZE = 256
+
+# log_clicks_batch() rows waiting for click_writer
+click_log_queue: asyncio.Queue = asyncio.Queue()
+writer_task = None
 
 
 def load_model():
     global model, model_name
 
     try:
-        print("Loading ML model and preprocessor...")
-
-        # Load ANN model and preprocessor
-        classifier = load_keras_model_safe("training/ann_click_fraud_model.h5")
+        logger.info("Loading ML model and preprocessor...")
+
+        # Load ANN model and preprocessor. The numpy and keras backends use
+        # the fused model when present, which takes unscaled features.
+        keras_path = FUSED_MODEL_PATH if os.path.exists(FUSED_MODEL_PATH) else MODEL_PATH
+        if MODEL_BACKEND == "numpy":
+            classifier = get_numpy_model(keras_path)
+            predict_fn = classifier.predict if classifier is not None else None
+            scales_input = keras_path != FUSED_MODEL_PATH
+        elif MODEL_BACKEND == "tflite":
+            classifier = get_model(TFLITE_MODEL_PATH)
+            predict_fn = classifier.predict if classifier is not None else None
+            scales_input = True
+        elif MODEL_BACKEND == "keras":
+            classifier = get_model(keras_path)
+            infer = get_inference_fn(keras_path, jit_compile=True)
+            predict_fn = lambda X: infer(X).numpy()
+            scales_input = keras_path != FUSED_MODEL_PATH
+        else:
+            raise RuntimeError(f"Unknown MODEL_BACKEND: {MODEL_BACKEND}")
         scaler = joblib.load("training/ann_preprocessor.pkl")
 
         if classifier is None:
             raise RuntimeError("Failed to load ANN model")
+        if classifier.input_shape[1] != N_FEATURES:
+            raise RuntimeError(f"Model expects {classifier.input_shape[1]} features, "
+                               f"FeatureBuilder produces {N_FEATURES}")
 
-        # ANN model input shape check (optional, handled by keras)
-        # print(f"Model expects {classifier.input_shape} features")
+        # FeatureBuilder.build_batch one-hot encodes in the same layout as the
+        # preprocessor, so only the numeric standard scaling is applied here
+        encoder_categories = [tuple(c) for c in scaler.named_transformers_["cat"].categories_]
+        if encoder_categories != [CATEGORIES[col] for col in CATEGORICAL_COLUMNS]:
+            raise RuntimeError("Preprocessor categories do not match FeatureBuilder")
+        numeric_scaler = scaler.named_transformers_["num"]
 
         model["classifier"] = classifier
+        model["predict_fn"] = predict_fn
         model["scaler"] = scaler
+        if scales_input:
+            model["num_mean"] = numeric_scaler.mean_.astype(np.float32)
+            # Reciprocal computed once, so scaling is a multiply per row
+            model["num_inv_scale"] = (1.0 / numeric_scaler.scale_).astype(np.float32)
+        else:
+            model["num_mean"] = model["num_inv_scale"] = None
+
+        # Run every batch size the batcher can issue through the model before
+        # the first request; the keras backend XLA-compiles once per size,
+        # which would otherwise land on whichever request first hits it
+        warmup = np.zeros((MAX_BATCH_SIZE, N_FEATURES), dtype=np.float32)
+        for batch_size in range(1, MAX_BATCH_SIZE + 1):
+            predict_fn(warmup[:batch_size])
 
         model_name = "ANN Click Fraud Detection Model"
+        model["info"] = {
+            "model_name": model_name,
+            "model_type": type(classifier).__name__,
+            "features_expected": int(classifier.input_shape[1])
+        }
+        model["ready"] = True
 
-        print("SUCCESS: Model loaded correctly")
+        logger.info("Model loaded correctly")
 
     except Exception as e:
-        print("ERROR loading model:", e)
+        logger.error("Error loading model: %s", e)
         raise RuntimeError("Model loading failed")
 
 
@@ -116,26 +218,121 @@ def get_risk_level(prob: float) -> str:
         return "High"
 
 
-def get_current_advertiser(request: Request):
+def set_session_cookie(response: Response, advertiser: Dict[str, Any]):
+    token = session_signer.sign(json.dumps(advertiser).encode()).decode()
+    response.set_cookie(
+        key="session_id",
+        value=token,
+        httponly=True,
+        max_age=SESSION_MAX_AGE
+    )
+
+
+async def get_current_advertiser(request: Request):
+    # async so FastAPI runs it on the event loop instead of a worker thread
     session_id = request.cookies.get("session_id")
-    print(f"Session ID from cookie: {session_id}")
-    if not session_id or session_id not in sessions:
-        print(f"Authentication failed. Available sessions: {list(sessions.keys())}")
+    if not session_id:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    advertiser = sessions[session_id]
-    print(f"Current advertiser: {advertiser}")
-    return advertiser
+    try:
+        return json.loads(session_signer.unsign(session_id, max_age=SESSION_MAX_AGE))
+    except BadSignature:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+# -------------------- BATCHING --------------------
+
+async def prediction_batcher():
+    """
+    Run queued /predict rows through the model together.
+
+    Takes whatever has queued up (at most MAX_BATCH_SIZE rows) while the
+    previous batch ran, so a lone request is never held back waiting.
+    Features are encoded into one buffer owned by the batcher and reused
+    for every batch.
+    """
+    buffer = np.zeros((MAX_BATCH_SIZE, N_FEATURES), dtype=np.float32)
+    while True:
+        items = [await batch_queue.get()]
+        while len(items) < MAX_BATCH_SIZE:
+            try:
+                items.append(batch_queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+        try:
+            X = FeatureBuilder.build_batch([click for click, _ in items],
+                                           out=buffer[:len(items)])
+
+            # Standardize the numeric columns, unless the model has the
+            # scaling folded in
+            if model["num_mean"] is not None:
+                X[:, :N_NUMERIC] -= model["num_mean"]
+                X[:, :N_NUMERIC] *= model["num_inv_scale"]
+
+            probs = model["predict_fn"](X).ravel()
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+
+        for (_, future), prob in zip(items, probs):
+            if not future.done():
+                future.set_result(float(prob))
+
+
+async def predict_fraud_probability(click: ClickData) -> float:
+    """Queue one click for the batcher and await its fraud probability"""
+    future = asyncio.get_running_loop().create_future()
+    await batch_queue.put((click, future))
+    return await future
+
+async def click_writer():
+    """
+    Write queued clicks to the database after their responses are sent.
+
+    Each pass writes everything queued so far (at most MAX_LOG_BATCH_SIZE
+    clicks) in one transaction, on a worker thread so the event loop keeps
+    serving requests.
+    """
+    while True:
+        clicks = [await click_log_queue.get()]
+        while len(clicks) < MAX_LOG_BATCH_SIZE:
+            try:
+                clicks.append(click_log_queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+        try:
+            await asyncio.to_thread(log_clicks_batch, clicks)
+        except Exception as e:
+            logger.error("Error logging %d clicks: %s", len(clicks), e)
 
 # -------------------- STARTUP --------------------
 
 @app.on_event("startup")
 async def startup_event():
-    print("Starting application...")
+    logger.info("Starting application...")
     os.makedirs("models", exist_ok=True)
     load_model()
+    global batcher_task, writer_task
+    batcher_task = asyncio.create_task(prediction_batcher())
     init_database()
     insert_sample_data()
-    print("Startup complete")
+    AD_CACHE.update((ad["id"], ad) for ad in get_ads_for_cache())
+    writer_task = asyncio.create_task(click_writer())
+    logger.info("Startup complete")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Stop the writer, then write whatever clicks are still queued
+    if writer_task is not None:
+        writer_task.cancel()
+    clicks = []
+    while not click_log_queue.empty():
+        clicks.append(click_log_queue.get_nowait())
+    if clicks:
+        log_clicks_batch(clicks)
 
 # -------------------- ROUTES --------------------
 
@@ -143,69 +340,42 @@ async def startup_event():
 async def root(request: Request):
     return templates.TemplateResponse("user_dashboard.html", {"request": request})
 
-@app.post("/auth/signup")
-async def signup(data: SignupRequest, response: Response):
-    advertiser_id = create_advertiser(data.name, data.email, data.password)
-    if advertiser_id is None:
-        raise HTTPException(400, "Email already registered")
-
-    session_id = str(uuid.uuid4())
-    sessions[session_id] = {"id": advertiser_id, "name": data.name, "email": data.email}
-
-    response.set_cookie("session_id", session_id, httponly=True)
-    return {"message": "Signup successful"}
-
-@app.post("/auth/login")
-async def login(data: LoginRequest, response: Response):
-    advertiser = authenticate_advertiser(data.email, data.password)
-    if not advertiser:
-        raise HTTPException(401, "Invalid credentials")
-
-    session_id = str(uuid.uuid4())
-    sessions[session_id] = advertiser
-    response.set_cookie("session_id", session_id, httponly=True)
-    return {"message": "Login successful"}
-
-
 @app.post("/predict", response_model=PredictionResponse)
 async def predict(click: ClickData):
 
-    if model["classifier"] is None:
+    if not model["ready"]:
         raise HTTPException(status_code=503, detail="Model not loaded")
 
-    ad_info = get_ad_with_advertiser(click.ad_id)
-    if not ad_info:
-        raise HTTPException(status_code=404, detail="Ad not found")
+    ad_info = AD_CACHE.get(click.ad_id)
+    if ad_info is None:
+        ad_info = get_ad_with_advertiser(click.ad_id)
+        if not ad_info:
+            raise HTTPException(status_code=404, detail="Ad not found")
+        AD_CACHE[click.ad_id] = ad_info
 
-    classifier = model["classifier"]
-    scaler = model["scaler"]
-
-    # Build features using FeatureBuilder
-    X = FeatureBuilder.build(click)
-
-    # Preprocess features
-    X_processed = scaler.transform(X)
-
-    # Predict
-    fraud_prob = float(classifier.predict(X_processed)[0][0])
+    # Predict, batched with any concurrent requests
+    fraud_prob = await predict_fraud_probability(click)
     fraud_prob = max(fraud_prob, 0.001)
 
     is_fraud = fraud_prob >= 0.5
     risk = get_risk_level(fraud_prob)
 
-    log_click(
-        ad_id=click.ad_id,
-        advertiser_id=ad_info["advertiser_id"],
-        session_id=click.session_id,
-        clicks_per_session=click.clicks_per_session,
-        time_gap_seconds=click.time_gap_seconds,
-        session_duration_minutes=click.session_duration_minutes,
-        user_agent_category=click.user_agent_category,
-        is_fraud=is_fraud,
-        fraud_probability=fraud_prob,
-        risk_level=risk,
-        model_used=model_name
-    )
+    # Logged by click_writer once the response is on its way
+    click_log_queue.put_nowait({
+        "ad_id": click.ad_id,
+        "advertiser_id": ad_info["advertiser_id"],
+        "session_id": click.session_id,
+        "clicks_per_session": click.clicks_per_session,
+        "time_gap_seconds": click.time_gap_seconds,
+        "session_duration_minutes": click.session_duration_minutes,
+        "user_agent_category": click.user_agent_category,
+        "is_fraud": is_fraud,
+        "fraud_probability": fraud_prob,
+        "risk_level": risk,
+        "model_used": model_name,
+        "ad_title": ad_info["title"],
+        "advertiser_name": ad_info["advertiser_name"]
+    })
 
     return PredictionResponse(
         is_fraud=is_fraud,
@@ -215,14 +385,6 @@ async def predict(click: ClickData):
     )
 
 
-@app.get("/health")
-async def health():
-    return {
-        "status": "running",
-        "model_loaded": model["classifier"] is not None,
-        "model_name": model_name
-    }
-
 @app.get("/login")
 async def login_page(request: Request):
     """Serve the login page"""
@@ -237,7 +399,9 @@ async def signup_page(request: Request):
 @app.post("/auth/signup")
 async def signup(signup_data: SignupRequest, response: Response):
     """Register new advertiser"""
-    advertiser_id = create_advertiser(
+    # Password hashing is deliberately slow; keep it off the event loop
+    advertiser_id = await asyncio.to_thread(
+        create_advertiser,
         name=signup_data.name,
         email=signup_data.email,
         password=signup_data.password
@@ -250,27 +414,21 @@ async def signup(signup_data: SignupRequest, response: Response):
         )
 
     # Create session
-    session_id = str(uuid.uuid4())
-    sessions[session_id] = {
+    set_session_cookie(response, {
         "id": advertiser_id,
         "name": signup_data.name,
         "email": signup_data.email
-    }
-
-    # Set session cookie
-    response.set_cookie(
-        key="session_id",
-        value=session_id,
-        httponly=True,
-        max_age=86400  # 24 hours
-    )
+    })
 
     return {"message": "Account created successfully", "advertiser_id": advertiser_id}
 
 @app.post("/auth/login")
 async def login(login_data: LoginRequest, response: Response):
     """Authenticate advertiser"""
-    advertiser = authenticate_advertiser(login_data.email, login_data.password)
+    # Verifying (and upgrading a legacy hash) runs scrypt, so use a thread
+    advertiser = await asyncio.to_thread(
+        authenticate_advertiser, login_data.email, login_data.password
+    )
 
     if not advertiser:
         raise HTTPException(
@@ -279,26 +437,13 @@ async def login(login_data: LoginRequest, response: Response):
         )
 
     # Create session
-    session_id = str(uuid.uuid4())
-    sessions[session_id] = advertiser
-
-    # Set session cookie
-    response.set_cookie(
-        key="session_id",
-        value=session_id,
-        httponly=True,
-        max_age=86400  # 24 hours
-    )
+    set_session_cookie(response, advertiser)
 
     return {"message": "Login successful", "advertiser": advertiser}
 
 @app.post("/auth/logout")
 async def logout(request: Request, response: Response):
     """Logout advertiser"""
-    session_id = request.cookies.get("session_id")
-    if session_id and session_id in sessions:
-        del sessions[session_id]
-
     response.delete_cookie("session_id")
     return {"message": "Logged out successfully"}
 
@@ -321,6 +466,7 @@ async def create_new_ad(
         image_url=ad_data.image_url,
         target_url=ad_data.target_url
     )
+    AD_CACHE[ad_id] = get_ad_with_advertiser(ad_id)
 
     return {"message": "Ad created successfully", "ad_id": ad_id}
 
@@ -345,7 +491,7 @@ async def health_check():
     return {
         "message": "Ad Click Fraud Detection API",
         "status": "running",
-        "model_loaded": model["classifier"] is not None,
+        "model_loaded": model["ready"],
         "model_name": model_name
     }
 
@@ -353,12 +499,9 @@ async def health_check():
 
 @app.get("/model/info")
 async def model_info():
-    classifier = model["classifier"]
-    return {
-        "model_name": model_name,
-        "model_type": type(classifier).__name__,
-        "features_expected": classifier.input_shape[1] if hasattr(classifier, "input_shape") else "Unknown"
-    }
+    if not model["ready"]:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    return model["info"]
 
 
 @app.get("/ads")
@@ -409,14 +552,18 @@ async def get_clicks(
         )
 
     try:
-        print(f"Loading sessions for advertiser_id: {advertiser_id}")
-        clicks = get_recent_clicks(advertiser_id, limit)
-        print(f"Found {len(clicks)} sessions for advertiser {advertiser_id}")
+        logger.debug("Loading sessions for advertiser_id: %s", advertiser_id)
+        clicks = list(get_recent_clicks(advertiser_id, limit))
+        logger.debug("Found %d sessions for advertiser %s", len(clicks), advertiser_id)
         return {"clicks": clicks}
     except Exception as e:
-        print(f"Error in get_clicks: {e}")
+        logger.error("Error in get_clicks: %s", e)
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+# Mounted after the API routes so they are matched first
+if SERVE_STATIC:
+    app.mount("/static", StaticFiles(directory="static"), name="static")
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8001)
+    uvicorn.run(app, host="127.0.0.1", port=8001, log_level="info")
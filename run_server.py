@@ -1,8 +1,10 @@
 """
 Startup script for Ad Click Fraud Detection System with Keras support
 """
+import os
+import secrets
+
 import uvicorn
-from main import app
 
 if __name__ == "__main__":
     print("Starting Ad Click Fraud Detection System...")
@@ -11,4 +13,14 @@ if __name__ == "__main__":
     print("API Docs: http://127.0.0.1:8001/docs")
     print()
     
-    uvicorn.run(app, host="127.0.0.1", port=8001)
\ No newline at end of file
+    # Each worker is a separate process that loads its own model; they must
+    # all sign session cookies with the same secret, so generate one here
+    # for the workers to inherit if none is configured
+    os.environ.setdefault("SESSION_SECRET", secrets.token_hex(32))
+    workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+
+    # Behind deploy/nginx.conf the proxy forwards to 127.0.0.1; set HOST to
+    # bind elsewhere (e.g. 0.0.0.0 when the proxy runs on another machine).
+    # The loop and HTTP parser default to uvloop and httptools when installed.
+    uvicorn.run("main:app", host=os.environ.get("HOST", "127.0.0.1"), port=8001,
+                workers=workers, proxy_headers=True, log_level="info")
\ No newline at end of file
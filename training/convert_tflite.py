@@ -0,0 +1,61 @@
+"""
+One-time conversion of the ANN to a TFLite model.
+Run from the project root: python training/convert_tflite.py [--int8]
+
+The default build stores float16 weights. --int8 quantizes fully, calibrated
+on FeatureBuilder rows; FeatureBuilder's scaled click_frequency spans far more
+than the other features, so one int8 input scale loses most of their
+resolution and decisions drift. Either way the result is checked against the
+Keras model on the rows the service actually builds.
+"""
+import itertools
+import os
+import sys
+from types import SimpleNamespace
+
+import joblib
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from feature_builder import FeatureBuilder, N_NUMERIC
+from keras_loader import load_keras_model_safe, convert_to_tflite, TFLiteModel
+
+OUTPUT_PATH = "training/ann.tflite"
+
+model = load_keras_model_safe("training/ann_click_fraud_model.h5")
+preprocessor = joblib.load("training/ann_preprocessor.pkl")
+numeric_scaler = preprocessor.named_transformers_["num"]
+
+# Grid over the /predict inputs, including the bot-score thresholds
+clicks = [
+    SimpleNamespace(clicks_per_session=cps, time_gap_seconds=gap,
+                    session_duration_minutes=duration, user_agent_category=uac)
+    for cps, gap, duration, uac in itertools.product(
+        (1, 2, 3, 5, 8, 10, 11, 15, 20, 30, 50),
+        (0.0, 0.2, 0.5, 0.9, 1.0, 1.5, 2.0, 5.0, 10.0, 30.0, 60.0),
+        (0.05, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0),
+        range(5),
+    )
+]
+served = FeatureBuilder.build_batch(clicks)
+served[:, :N_NUMERIC] = (served[:, :N_NUMERIC] - numeric_scaler.mean_) / numeric_scaler.scale_
+training = np.asarray(preprocessor.transform(pd.read_csv("training/click_fraud_dataset.csv")),
+                      dtype=np.float32)
+
+if "--int8" in sys.argv:
+    calibration = served[np.random.default_rng(0).permutation(len(served))]
+    convert_to_tflite(model, OUTPUT_PATH, representative_data=calibration,
+                      max_samples=len(calibration))
+else:
+    convert_to_tflite(model, OUTPUT_PATH)
+
+tflite_model = TFLiteModel(OUTPUT_PATH)
+for name, X in (("FeatureBuilder grid", served), ("training CSV", training)):
+    expected = model.predict(X, verbose=0).ravel()
+    actual = tflite_model.predict(X).ravel()
+    flips = int(((expected >= 0.5) != (actual >= 0.5)).sum())
+    print(f"{name}: {flips} of {len(X)} fraud decisions differ, "
+          f"max probability error {np.abs(expected - actual).max():.4f}")
+
+print(f"Saved TFLite model to {OUTPUT_PATH}")
@@ -0,0 +1,33 @@
+"""
+One-time fold of the preprocessor's numeric StandardScaler into the ANN's
+first Dense layer, so the fused model takes unscaled features directly.
+Run from the project root: python training/fuse_scaler.py
+"""
+import os
+import sys
+
+import joblib
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from keras_loader import load_keras_model_safe
+
+model = load_keras_model_safe("training/ann_click_fraud_model.h5")
+preprocessor = joblib.load("training/ann_preprocessor.pkl")
+numeric_scaler = preprocessor.named_transformers_["num"]
+mean = numeric_scaler.mean_
+scale = numeric_scaler.scale_
+n_numeric = len(mean)
+
+# Numeric columns come first in the encoded row; the one-hot rows of the
+# kernel pass through unchanged.
+#   W . ((x - mean) / scale) + b  ==  (W / scale) . x + (b - (mean / scale) . W)
+first = model.layers[0]
+kernel, bias = first.get_weights()
+kernel = kernel.astype(np.float64)
+fused_bias = bias - (mean / scale) @ kernel[:n_numeric]
+kernel[:n_numeric] /= scale[:, np.newaxis]
+first.set_weights([kernel.astype(np.float32), fused_bias.astype(np.float32)])
+
+model.save("training/ann_click_fraud_model_fused.h5")
+print("Saved fused model to training/ann_click_fraud_model_fused.h5")